@@ -1,26 +1,96 @@
 
 
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+from flask import Flask, render_template, request, redirect, url_for, flash, session, send_file
+from flask import stream_template
 import pandas as pd
+import numpy as np
 import os
-import qrcode
+import hashlib
+import shutil
+import tempfile
+import stat
+import functools
+import threading
+import segno
 from io import BytesIO
-from flask import send_file
+from datetime import datetime, timezone
+from flask_session import Session
+import redis
+
+try:
+    from numba import njit, prange
+except ImportError:  # optional: only used for very large catalogs
+    njit = None
 
 
 app = Flask(__name__)
 app.secret_key = "dev-secret"  # OK for local testing only
 
+# Keep sessions (and the shopping list in them) server-side in Redis so the
+# cart isn't shipped and re-signed in a cookie on every request.
+app.config.update(
+    SESSION_TYPE="redis",
+    SESSION_REDIS=redis.Redis.from_url(
+        os.environ.get("REDIS_URL", "redis://localhost:6379/0")),
+    SESSION_PERMANENT=False,
+)
+Session(app)
+
 # Path to Excel inventory
 DATA_PATH = os.path.join("data", "inventory.xlsx")
 
+# Columns the products page actually renders
+PRODUCT_COLUMNS = ["sku", "name", "brand", "size",
+                   "price", "aisle", "stock_qty"]
 
-def load_products():
+# Parsed inventory, reused until the Excel file changes on disk
+_CACHE = {"mtime": None, "df": None, "by_sku": None, "lc_bufs": {},
+          "snapshot": None}
+
+# Above this many rows, with numba installed but no pyarrow (whose string
+# kernels are faster still), search runs in a compiled parallel kernel
+# instead of pandas' object-dtype .str.contains
+NUMBA_MIN_ROWS = 100_000
+
+# numba's fallback "workqueue" threading layer aborts the process if two
+# threads run a parallel kernel at once (gthread workers do exactly that),
+# so kernel calls are serialized; each call still uses every core
+_KERNEL_LOCK = threading.Lock()
+
+# Rendered /shopping-list pages keyed on (cart, coins, inventory mtime)
+_RENDER_CACHE = {}
+_RENDER_CACHE_MAX = 256
+_RENDER_CACHE_LOCK = threading.Lock()
+
+# Parquet copies of the cleaned inventory survive restarts; one file per
+# XLSX content hash. Set GROCERZ_NO_CACHE=1 to always re-parse the Excel.
+PARQUET_CACHE_DIR = os.path.join("data", ".cache")
+
+# process umask, read once at import (os.umask can only be queried by setting
+# it, which isn't safe to do later from request threads)
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def read_inventory_excel(path):
+    """
+    Read the raw Excel sheet. Prefers the calamine engine (much faster
+    parse) and falls back to openpyxl when python-calamine is missing.
+    """
+    try:
+        return pd.read_excel(path, engine="calamine")
+    except (ImportError, ValueError):
+        # ImportError: python-calamine not installed
+        # ValueError: pandas too old to know the calamine engine
+        return pd.read_excel(path, engine="openpyxl")
+
+
+def parse_inventory(path):
     """
-    Read Excel into a pandas DataFrame and return it.
+    Read the Excel file and clean it.
     Keeps logic simple and robust for common messy Excel files.
     """
-    df = pd.read_excel(DATA_PATH, engine="openpyxl")
+    df = read_inventory_excel(path)
 
     # ensure text columns exist and clean them
     text_cols = ["sku", "name", "brand", "size",
@@ -44,6 +114,183 @@ def load_products():
     return df
 
 
+def parquet_cache_path(path):
+    """Return the sidecar parquet path for the current contents of `path`."""
+    with open(path, "rb") as f:
+        digest = hashlib.sha1(f.read()).hexdigest()
+    return os.path.join(PARQUET_CACHE_DIR, digest + ".parquet")
+
+
+def write_parquet_cache(df, cache_path):
+    """
+    Best-effort write of the parquet sidecar. Writes to a temp name and
+    renames it into place so other workers never read a half-written file.
+    Any failure (pyarrow missing, read-only dir, columns pyarrow can't
+    convert such as mixed numbers and text) just skips the sidecar.
+    """
+    tmp_path = "%s.%d.tmp" % (cache_path, os.getpid())
+    try:
+        os.makedirs(PARQUET_CACHE_DIR, exist_ok=True)
+        df.to_parquet(tmp_path, engine="pyarrow", compression="zstd")
+        os.replace(tmp_path, cache_path)
+    except Exception:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+def load_products():
+    """
+    Return the cleaned inventory as a pandas DataFrame.
+
+    The DataFrame is cached in memory and only reloaded when the file's
+    mtime changes, so callers must treat it as read-only. On reload a
+    parquet sidecar is used when available instead of parsing the Excel.
+    """
+    st = os.stat(DATA_PATH)
+    if _CACHE["mtime"] == st.st_mtime_ns:
+        return _CACHE["df"]
+
+    use_disk_cache = not os.environ.get("GROCERZ_NO_CACHE")
+    cache_path = parquet_cache_path(DATA_PATH) if use_disk_cache else None
+
+    df = None
+    if cache_path and os.path.exists(cache_path):
+        try:
+            df = pd.read_parquet(cache_path, engine="pyarrow")
+        except Exception:
+            df = None  # unreadable sidecar: fall back to the Excel
+
+    if df is None:
+        df = parse_inventory(DATA_PATH)
+        if cache_path:
+            write_parquet_cache(df, cache_path)
+
+    # lowercase copies for search, computed once per load
+    df["_name_lc"] = df["name"].str.lower()
+    df["_sku_lc"] = df["sku"].str.lower()
+    df["_brand_lc"] = df["brand"].str.lower()
+
+    # Arrow-backed strings: contiguous memory and C substring kernels
+    try:
+        for c in ("_name_lc", "_sku_lc", "_brand_lc", "name", "sku", "brand"):
+            df[c] = df[c].astype("string[pyarrow]")
+        arrow_strings = True
+    except ImportError:
+        arrow_strings = False  # pyarrow not installed, keep object dtype
+
+    _CACHE["df"] = df
+    # same rows indexed by sku for hashed lookups (first row wins on duplicates)
+    _CACHE["by_sku"] = df.drop_duplicates("sku").set_index("sku", drop=False)
+    # UTF-8 bytes + offsets copies of the search columns for the numba kernel
+    lc_bufs = {}
+    if njit is not None and not arrow_strings and len(df) >= NUMBA_MIN_ROWS:
+        for c in ("_name_lc", "_sku_lc", "_brand_lc"):
+            lc_bufs[c] = pack_strings(df[c])
+    _CACHE["lc_bufs"] = lc_bufs
+    # one tuple, assigned at once, so readers never mix two loads
+    _CACHE["snapshot"] = (st.st_mtime_ns, df, _CACHE["by_sku"])
+    # set last: other threads treat a matching mtime as "cache is complete"
+    _CACHE["mtime"] = st.st_mtime_ns
+    return df
+
+
+def ingest_inventory(upload_path, df):
+    """
+    Move an uploaded Excel file, already cleaned into `df` by
+    parse_inventory(), into DATA_PATH and write its parquet sidecar, so the
+    admin upload pays the parse cost instead of the next visitor.
+    """
+    # temp files are created 0600; give the inventory the mode it had
+    # before (or the umask default, as a plain save would)
+    if os.path.exists(DATA_PATH):
+        mode = stat.S_IMODE(os.stat(DATA_PATH).st_mode)
+    else:
+        mode = 0o666 & ~_UMASK
+    os.chmod(upload_path, mode)
+    os.replace(upload_path, DATA_PATH)
+    _CACHE["mtime"] = None
+    shutil.rmtree(PARQUET_CACHE_DIR, ignore_errors=True)
+    if not os.environ.get("GROCERZ_NO_CACHE"):
+        write_parquet_cache(df, parquet_cache_path(DATA_PATH))
+    return load_products()
+
+
+def load_products_by_sku():
+    """Return the cached inventory indexed by sku (read-only, unique index)."""
+    return load_inventory_snapshot()[2]
+
+
+def load_inventory_snapshot():
+    """
+    Return (mtime_ns, df, by_sku) from one consistent load, for callers
+    that key other caches on the inventory version. Unlike _CACHE["mtime"],
+    the mtime here is never None and always matches the frames with it.
+    """
+    load_products()
+    return _CACHE["snapshot"]
+
+
+def pack_strings(values):
+    """
+    Pack strings into one flat UTF-8 uint8 buffer plus int64 offsets
+    (row i is buf[offsets[i]:offsets[i + 1]]), so the kernel needs no
+    per-row Python objects and memory is not padded to the longest string.
+    """
+    encoded = [str(v).encode("utf-8") for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    buf = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    return buf, offsets
+
+
+if njit is not None:
+    @njit(parallel=True, cache=True)
+    def _substr_mask(buf, offsets, needle):
+        # UTF-8 is self-synchronizing, so a byte match is a character match
+        n = offsets.shape[0] - 1
+        m = needle.shape[0]
+        out = np.zeros(n, np.bool_)
+        for i in prange(n):
+            last = offsets[i + 1] - m
+            j = offsets[i]
+            while j <= last:
+                k = 0
+                while k < m and buf[j + k] == needle[k]:
+                    k += 1
+                if k == m:
+                    out[i] = True
+                    break
+                j += 1
+        return out
+
+
+def warm_search_kernel():
+    """
+    Compile the numba kernel now (e.g. in a gunicorn worker right after
+    fork) if the loaded catalog will use it, so no request pays the JIT.
+    """
+    if njit is not None and _CACHE["lc_bufs"]:
+        buf, offsets = pack_strings(["warm"])
+        with _KERNEL_LOCK:
+            _substr_mask(buf, offsets, np.frombuffer(b"a", dtype=np.uint8))
+
+
+def contains_mask(df, col, q):
+    """
+    Return a numpy bool array: does df[col] contain `q` (literal substring)?
+    Uses the numba kernel when load_products() prepared a buffer for the
+    cached frame, otherwise pandas' vectorized .str.contains.
+    """
+    packed = _CACHE["lc_bufs"].get(col)
+    if packed is not None and df is _CACHE["df"]:
+        needle = np.frombuffer(q.encode("utf-8"), dtype=np.uint8)
+        with _KERNEL_LOCK:
+            return _substr_mask(packed[0], packed[1], needle)
+    return df[col].str.contains(q, regex=False, na=False).to_numpy(dtype=bool)
+
+
 def stock_label(qty):
     """Return only 'In stock' or 'Out of stock'"""
     try:
@@ -54,24 +301,56 @@ def stock_label(qty):
     return "Out of stock"
 
 
+class ProductRows:
+    """
+    Re-iterable view over DataFrame rows as namedtuples. The products
+    template loops twice (table + mobile cards), so a one-shot generator
+    is not enough, but each loop still only holds one row at a time.
+    """
+
+    def __init__(self, df):
+        self.df = df
+
+    def __iter__(self):
+        return self.df.itertuples(index=False, name="Row")
+
+
 def get_shopping_list():
     """Ensure shopping_list exists in session and return it (dict: sku -> qty)."""
     session.setdefault("shopping_list", {})
     return session["shopping_list"]
 
 
-def generate_qr(link: str) -> BytesIO:
+@functools.lru_cache(maxsize=4096)
+def _encode_qr(link: str):
+    """Encode `link` into a QR symbol (matrix only, cached per link)."""
+    # make_qr, not make: short links would otherwise become Micro QR,
+    # which most phone cameras can't scan
+    return segno.make_qr(link, error="m")
+
+
+@functools.lru_cache(maxsize=4096)
+def _qr_bytes(link: str, box_size: int = 6, border: int = 2) -> bytes:
+    """Render the cached QR for `link` as PNG bytes at the given size."""
+    buf = BytesIO()
+    # Plain black on white keeps segno on its 1-bit greyscale PNG path,
+    # far smaller than an RGB/palette image.
+    _encode_qr(link).save(buf, kind="png", scale=box_size, border=border,
+                          dark="black", light="white", compresslevel=9)
+    return buf.getvalue()
+
+
+def generate_qr(link: str, box_size: int = 6) -> BytesIO:
     """
     Create a PNG QR image for `link` and return a BytesIO buffer ready to send.
+    Other sizes reuse the same encoded matrix and are only re-rasterized.
     """
-    qr = qrcode.QRCode(box_size=6, border=2)
-    qr.add_data(link)
-    qr.make(fit=True)
-    img = qr.make_image(fill_color="black", back_color="white")
-    buf = BytesIO()
-    img.save(buf, format="PNG")
-    buf.seek(0)
-    return buf
+    return BytesIO(_qr_bytes(link, box_size))
+
+
+# QR images depend only on the link, so they are treated as unchanged since boot
+QR_LAST_MODIFIED = datetime.now(timezone.utc).replace(microsecond=0)
+QR_CACHE_CONTROL = "public, max-age=31536000, immutable"
 
 
 # ROUTES
@@ -91,23 +370,37 @@ def products():
 
     df = load_products()
 
-    # simple search: name or sku
+    # Build one boolean mask in place and filter once, instead of
+    # allocating a new array (and a new DataFrame) per condition.
+    mask = None
+
+    # simple search: name or sku. contains_mask is a literal substring
+    # match, so input like "a+b" or "(" is safe and skips the regex engine.
     if q:
-        mask = df["name"].str.lower().str.contains(
-            q) | df["sku"].str.lower().str.contains(q)
-        df = df[mask]
+        # fresh array we own: contains_mask may hand back a read-only view
+        mask = np.logical_or(contains_mask(df, "_name_lc", q),
+                             contains_mask(df, "_sku_lc", q))
 
     # brand filter
     if brand_q:
-        df = df[df["brand"].str.lower().str.contains(brand_q)]
+        brand_mask = contains_mask(df, "_brand_lc", brand_q)
+        if mask is None:
+            mask = brand_mask
+        else:
+            np.logical_and(mask, brand_mask, out=mask)  # mask is ours here
 
-    # create availability text
-    df["availability"] = df["stock_qty"].apply(stock_label)
+    if mask is not None:
+        df = df[mask]
+
+    # availability is decided in the template from stock_qty, so the
+    # (cached) DataFrame never needs copying to add a column
 
-    # convert to list of dicts for template
-    products = df.to_dict(orient="records")
+    # stream rows into the template instead of building a list of dicts,
+    # only with the columns it shows
+    products = ProductRows(df[PRODUCT_COLUMNS])
 
-    return render_template("products.html", products=products, q=q, brand=brand_q)
+    return app.response_class(stream_template(
+        "products.html", products=products, q=q, brand=brand_q))
 
 
 # Add to shopping list
@@ -123,8 +416,7 @@ def add_to_list():
     if qty < 1:
         qty = 1
 
-    df = load_products()
-    if df[df["sku"] == sku].empty:
+    if sku not in load_products_by_sku().index:
         flash("Product not found.")
         return redirect(url_for("products"))
 
@@ -139,24 +431,39 @@ def add_to_list():
 @app.route("/shopping-list")
 def shopping_list():
     cart = get_shopping_list()
-    items = []
-    if cart:
-        df = load_products()
-        for sku, qty in cart.items():
-            row = df[df["sku"] == sku]
-            if row.empty:
-                items.append(
-                    {"sku": sku, "name": "(not in inventory)", "qty": qty, "aisle": ""})
-            else:
-                r = row.iloc[0]
-                items.append({
-                    "sku": sku,
-                    "name": r["name"],
-                    "qty": qty,
-                    "aisle": r.get("aisle", "")
-                })
-    total_items = sum(cart.values()) if cart else 0
-    return render_template("shopping_list.html", items=items, total_items=total_items)
+    if not cart:
+        return render_template("shopping_list.html", items=[], total_items=0)
+
+    # The page is a pure function of the cart (in order), the coins shown in
+    # the header and the inventory file, so a repeat refresh reuses the HTML.
+    # The mtime part makes a new upload invalidate old entries automatically;
+    # it comes from the same snapshot as the rows rendered below.
+    mtime, _, by_sku = load_inventory_snapshot()
+    key = (tuple(cart.items()), session.get("coins", 0), mtime)
+    with _RENDER_CACHE_LOCK:
+        html = _RENDER_CACHE.get(key)
+    if html is not None:
+        return html
+
+    # one hashed gather for the whole cart; missing skus come back as NaN
+    rows = by_sku.reindex(list(cart.keys()))
+    rows["sku"] = rows.index
+    rows["qty"] = list(cart.values())
+    rows["name"] = rows["name"].fillna("(not in inventory)")
+    rows["aisle"] = rows["aisle"].fillna("")
+    items = rows[["sku", "name", "qty", "aisle"]].to_dict(orient="records")
+    total_items = sum(cart.values())
+    html = render_template("shopping_list.html",
+                           items=items, total_items=total_items)
+
+    if mtime is None:
+        return html  # unknown inventory version: never cache
+    with _RENDER_CACHE_LOCK:
+        if len(_RENDER_CACHE) >= _RENDER_CACHE_MAX:
+            # drop the oldest entry (dicts keep insertion order)
+            _RENDER_CACHE.pop(next(iter(_RENDER_CACHE)))
+        _RENDER_CACHE[key] = html
+    return html
 
 
 @app.route("/update_shopping_list", methods=["POST"])
@@ -220,14 +527,31 @@ def qr():
     """
     Return PNG image for a QR. Pass ?link=<url> to create a QR for any URL.
     If no link given, defaults to site root.
+    Optional ?box=<n> sets pixels per module (default 6).
     Example: /qr?link=https%3A%2F%2Fexample.com
     """
     link = request.args.get("link")
     if not link:
         # default to app root (use request.host_url to build absolute URL)
         link = request.host_url.rstrip("/")  # e.g. http://127.0.0.1:5000
-    buf = generate_qr(link)
-    return send_file(buf, mimetype="image/png")
+    # optional ?box=<pixels per module>, kept to a sane range
+    box_size = min(max(request.args.get("box", 6, type=int), 1), 20)
+    etag = hashlib.md5(f"{link}|{box_size}".encode("utf-8")).hexdigest()
+
+    # browser already has this image: answer 304 without encoding anything
+    since = request.if_modified_since
+    # If-None-Match uses weak comparison (RFC 7232), so W/"..." still matches
+    if request.if_none_match.contains_weak(etag) or (
+            not request.if_none_match and since and since >= QR_LAST_MODIFIED):
+        response = app.response_class(status=304)
+    else:
+        response = send_file(generate_qr(link, box_size), mimetype="image/png")
+
+    # QR content for a given link never changes
+    response.set_etag(etag)
+    response.last_modified = QR_LAST_MODIFIED
+    response.headers["Cache-Control"] = QR_CACHE_CONTROL
+    return response
 
 
 @app.route("/show-qr")
@@ -252,7 +576,23 @@ def upload():
         flash("Please select an Excel file to upload.")
         return redirect(url_for("index"))
     os.makedirs("data", exist_ok=True)
-    file.save(DATA_PATH)
+    # save next to DATA_PATH (same filesystem for os.replace); keep the
+    # .xlsx suffix since the Excel readers look at it
+    fd, tmp_path = tempfile.mkstemp(suffix=".xlsx", dir="data")
+    os.close(fd)
+    file.save(tmp_path)
+    try:
+        # parse before touching DATA_PATH: a bad file must not replace
+        # the working inventory
+        try:
+            df = parse_inventory(tmp_path)
+        except Exception:
+            flash("Could not read that Excel file. The current inventory was kept.")
+            return redirect(url_for("index"))
+        ingest_inventory(tmp_path, df)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
     flash("Inventory uploaded. Visit /products to see the items.")
     return redirect(url_for("products"))
 
@@ -260,6 +600,8 @@ def upload():
 # ----------------------
 # Run server
 # ----------------------
+# Development only. In production run under gunicorn (see gunicorn.conf.py):
+#   gunicorn app:app
 if __name__ == "__main__":
     print("Running Grocerz at http://127.0.0.1:5000")
-    app.run(debug=True)
+    app.run(debug=os.environ.get("FLASK_DEBUG") == "1")
@@ -0,0 +1,35 @@
+# Production server settings for Grocerz. Run with:
+#   gunicorn app:app
+import os
+
+# localhost only by default, like the dev server: /admin/upload has no auth
+# and app.secret_key is a dev value. Set GROCERZ_BIND (e.g. 0.0.0.0:5000)
+# only behind a proxy/deployment that handles both.
+bind = os.environ.get("GROCERZ_BIND", "127.0.0.1:5000")
+
+# preforked workers, each with a thread pool, so concurrent requests
+# don't queue behind one another like on the dev server
+workers = int(os.environ.get("GROCERZ_WORKERS", "4"))
+worker_class = "gthread"
+threads = int(os.environ.get("GROCERZ_THREADS", "8"))
+
+# import app (pandas, numba, ...) once in the master and fork from it
+preload_app = True
+
+
+def post_fork(server, worker):
+    """
+    Warm each worker's inventory cache (and, for large catalogs, the numba
+    search kernel) so the first request doesn't parse or compile.
+    """
+    from app import load_products, warm_search_kernel
+    try:
+        load_products()
+        warm_search_kernel()
+    except FileNotFoundError:
+        pass  # no inventory uploaded yet
+    except Exception:
+        # warming is optional: boot with a cold cache rather than failing the
+        # worker (and with it the whole server); inventory pages will report
+        # the problem on their own
+        worker.log.exception("Could not warm the inventory cache")